@@ -6,4 +6,4 @@ Created on Thu Oct  8 20:48:51 2020
 @author: ivan
 """
 
-from .src.spectra_Load import *
+from .src.spectra_Load import spcat, Catalog, pload, cf, err, paths
@@ -1,13 +1,6 @@
-import os
 import sys
-from tqdm import tqdm
-from datetime import datetime
-import time
-import shutil
 
 import numpy as np
-import scipy.integrate as spint
-import matplotlib.pyplot as plt
 
 from .spectra_InitSettings import cf, err, paths
 
@@ -49,23 +42,57 @@ def IndMaxima(arr,s=1):
         - s:    1: means local maxima
                -1: means local minima
     outputs:
-        - iextr: array of local extrema (maxima or minima) indices"""
-    dersgn = np.zeros((len(arr)-1))
-    iextr = np.empty((0),dtype=np.int64)
-    for i in range(len(arr)-1):
-        dersgn[i] = np.sign(arr[i+1]-arr[i])
-    for i in range(0,len(arr)-2):
-        if dersgn[i] == s and dersgn[i+1] == -s:
-            iextr = np.append(iextr,i+1)
-        if dersgn[i] == s and dersgn[i+1] == 0:
-            for j in range(i+1, len(arr)-1):
-                if dersgn[j] != 0:
-                    if dersgn[j] == -s:
-                        iextr = np.append(iextr,np.arange(i+1,j+1))
-                    break
-    return iextr
+        - iextr: array of local extrema (maxima or minima) indices. All the points of a plateau extremum are included."""
+    return np.flatnonzero(MaskExtrema(np.sign(np.diff(arr)), s))
+
+def MaskExtrema(dersgn,s=1):
+    """Same extrema as IndMaxima, but taken from the signs of the differences between consecutive points,
+    and given as a mask. A point is a local maximum (minimum) when the last nonzero sign before it is s and the
+    first nonzero sign from it on is -s. This is how plateaus are handled as well.
+    inputs:
+        - dersgn: np.ndarray
+            np.sign(np.diff(arr))
+        - s:    1: means local maxima
+               -1: means local minima
+    outputs:
+        - np.ndarray of bool, one more element than dersgn: True at the extrema"""
+    n = np.size(dersgn)
+    pos = np.arange(n)
+    nonzero = dersgn != 0
+    #Last nonzero sign before each point, and first nonzero sign from each point on (-1 and n when missing)
+    before = np.hstack(([-1], np.maximum.accumulate(np.where(nonzero, pos, -1))))
+    after = np.hstack((np.minimum.accumulate(np.where(nonzero, pos, n)[::-1])[::-1], [n]))
+    signs = np.hstack((dersgn, [0]))
+    return (before >= 0) & (signs[before] == s) & (after < n) & (signs[after] == -s)
+
+def ExtremaWindow(arr,i0,i1):
+    """Slice of an array where the extrema from index i0 to i1 (both included) are found as in the whole array.
+    It reaches the points right beyond the plateaus at both ends, as they decide whether the ends are extrema.
+    inputs:
+        - arr: 1-d numpy array
+        - i0, i1: int
+            first and last index of interest
+    outputs:
+        - slice"""
+    before = np.flatnonzero(arr[:i0] != arr[i0])
+    after = np.flatnonzero(arr[i1+1:] != arr[i1])
+    return slice(before[-1] if np.size(before) else 0, i1+2+after[0] if np.size(after) else len(arr))
 
 # A couple little functions to ask for parameters. Just for code reusability's sake.
+def IsTerminal():
+    """Whether the program is run from a terminal, where questions can be answered."""
+    return sys.stdin is not None and sys.stdin.isatty()
+def Ask(question,default):
+    """Asks a question at the command line. Without a terminal (scripts, pipelines) nothing is asked,
+    and the default answer is taken, so that unattended runs neither block nor fail.
+    inputs:
+        - question: str
+            prompt shown
+        - default: str
+            answer taken when not running on a terminal
+    outputs:
+        - str: the answer"""
+    return input(question) if IsTerminal() else default
 def AskAxis():
     return True if input('x-axis: (1 eV; [2] ToF) >').lower() in ['1','ev'] else False
 def AskLim():
@@ -166,15 +193,12 @@ def Smooth(arr,it):
     outputs:
         - smoothed array"""
     if len(np.shape(arr)) > 1:
-        arr0 = np.copy(arr)[1]
+        arr0 = arr[1]
     else:
-        arr0 = np.copy(arr)
+        arr0 = arr
+    #Each iteration is a whole-array pass, the ends set to 0
     for j in range(it):
-        temp = [0.]
-        for i in range(1,np.size(arr0)-1):
-            temp.append((arr0[i-1]+2*arr0[i]+arr0[i+1])/4)
-        temp.append(0.)
-        arr0 = np.copy(np.array(temp))
+        arr0 = np.concatenate(([0.], (arr0[:-2]+2*arr0[1:-1]+arr0[2:])/4, [0.]))
     if len(np.shape(arr)) > 1 and np.shape(arr)[0] > 1:
         arr0 = [arr[0],arr0]
         for i in range(2,np.shape(arr)[0]):
@@ -202,3 +226,84 @@ def FitBoxes(array,dboxes):
     except Exception as e:
         err.add('FitBoxes',isotope,e)
         return None, None
+
+def BoxMode(array,dboxes,tries=9):
+    """Most repeated value of an array once fit in boxes (see FitBoxes). While every value falls in a box of
+    its own, the density of boxes is multiplied by 2, 3... up to tries. Ties go to the lowest value.
+    Fitting in boxes keeps the order of the values, so the array is sorted only once, and the repeated
+    values are counted as runs of equal neighbours.
+    inputs:
+        - array: (np.ndarray)
+            numpy array to fit
+        - dboxes:
+            density of points/boxes for the first try
+        - tries: int
+            maximum number of densities tried
+    outputs:
+        - most repeated fitted value, box width of the last density tried"""
+    arr = np.sort(array)
+    #Same as np.min and np.max: NaN if there is any NaN (sorted at the end)
+    b0, b1 = (arr[0], arr[-1]) if not np.isnan(arr[-1]) else (arr[-1], arr[-1])
+    #The normalised values don't depend on the density of boxes.
+    norm = (arr-b0)/(b1-b0)
+    nannorm = np.isnan(norm).any()
+    for i in range(1,tries+1):
+        nboxes = dboxes*i*(b1-b0)
+        fit = (b1-b0)*(np.around(norm*(nboxes-1))/(nboxes-1))+b0
+        #Is any value equal to the next one? (NaNs are taken as equal, like np.unique does)
+        #Fitted NaNs only come from NaNs in norm, or from a zero or non-finite number of boxes.
+        same = fit[1:] == fit[:-1]
+        if nannorm or not (np.isfinite(nboxes) and nboxes != 1):
+            same |= np.isnan(fit[1:]) & np.isnan(fit[:-1])
+        if same.any(): break
+    #Bounds of every run of equal values
+    bounds = np.concatenate(([0], np.flatnonzero(~same)+1, [np.size(fit)]))
+    longest = np.argmax(np.diff(bounds))
+    return fit[bounds[longest]], (b1-b0)/(2*nboxes)
+
+def SafeDivide(num,den):
+    """Element-wise division of arrays, giving 0 wherever the denominator is 0.
+    inputs:
+        - num: np.ndarray or float
+        - den: np.ndarray
+    outputs:
+        - np.ndarray with the shape of den"""
+    if den.all():
+        return num/den
+    return np.true_divide(num, den, out=np.zeros(np.shape(den)), where=den!=0)
+
+def Simpson(y,x):
+    """Integrates y(x) with the composite Simpson's rule, for irregularly spaced x. Same result as
+    scipy.integrate.simpson: with an even number of points, the last interval is a 3-point parabolic segment
+    (Cartwright), and two points are integrated as a trapezoid. Written for short 1-d arrays, which is where
+    scipy's own argument handling costs more than the sum itself.
+    inputs:
+        - y: np.ndarray (1-d)
+            values to integrate
+        - x: np.ndarray (1-d)
+            sample points, same size as y
+    outputs:
+        - integral"""
+    n = np.size(y)
+    if n == 2:
+        return 0.0 + 0.5*(x[1]-x[0])*(y[1]+y[0])
+    h = np.diff(x).astype(float, copy=False)
+    #Simpson panels over the first n-1 (n-2) intervals
+    stop = n-2 if n%2 else n-3
+    h0, h1 = h[0:stop:2], h[1:stop+1:2]
+    hsum, hprod = h0+h1, h0*h1
+    h0divh1 = SafeDivide(h0, h1)
+    h1divh0 = SafeDivide(1.0, h0divh1)
+    hsumdivhprod = SafeDivide(hsum, hprod)
+    result = (hsum/6.0*(y[0:stop:2]*(2.0-h1divh0) + y[1:stop+1:2]*(hsum*hsumdivhprod) +\
+                        y[2:stop+2:2]*(2.0-h0divh1))).sum()
+    if n%2:
+        return result
+    #Parabolic segment for the last interval. The spacings are kept as arrays, numpy powers of arrays and
+    #of scalars don't always round the same way.
+    h0, h1 = h[-2:-1], h[-1:]
+    alpha = SafeDivide(2*h1**2+3*h0*h1, 6*(h1+h0))
+    beta = SafeDivide(h1**2+3.0*h0*h1, 6*h0)
+    eta = SafeDivide(1*h1**3, 6*h0*(h0+h1))
+    result += (alpha*y[-1]+beta*y[-2]-eta*y[-3])[0]
+    return result + 0.0
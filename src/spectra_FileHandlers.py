@@ -1,5 +1,4 @@
 import os
-from tqdm import tqdm
 from datetime import datetime
 import time
 import shutil
@@ -8,13 +7,28 @@ import numpy as np
 from . import spectra_Basics as basics
 from . import spectra_Finders as finder
 from . import spectra_Mixer as mixer
-from .spectra_InitSettings import cf, peakattr, err, paths
+from .spectra_InitSettings import cf, peakattr, paths
 
 #Notice: some of the functions presented in this file are actually methods of classes presented in spectra_Objects.
 
 file_peaks_human = 'PeakProperties.txt'
 file_peaks_nonhuman = 'peakprops.txt'
 file_pickle = 'spcat.pickle'
+file_buffers = 'spcat.buffers.bin'
+
+#Buffer size (bytes) when writing the catalog files: big enough to keep the number of write calls low.
+#(They are memory-mapped for reading.)
+pickle_buffering = 1 << 20
+
+#Alignment (bytes) of every array in the sidecar file, so that the arrays mapped from it are aligned.
+buffer_alignment = 64
+
+#Start of the sidecar file, followed by the random token of the save it belongs to.
+buffers_magic = b'NRCASPCB'
+
+#Whether pload() memory-maps the sidecar file. psave() replaces it with a rename, which is only
+#allowed while the file is mapped on POSIX systems, so it is read into memory elsewhere.
+map_buffers = os.name == 'posix'
 
 ans_yes = ['yes', 'Yes', 'y', 'Y', 'YES', 1, '1']
 ans_no = ['no', 'No', 'n', 'N', 'NO', 0, '0']
@@ -23,26 +37,110 @@ ans_quit = ['quit', 'Quit', 'q', 'Q', 'esc', 'Esc', 'ESC', 'QUIT', 'x']
 def psave(self):
     """This is a method.
     Method that saves the pickle representation of the catalog class to the cwd.
+    Pickle protocol 5 is used so that the spectra arrays are taken out of band: their raw bytes
+    go to a sidecar file (spcat.buffers.bin), each of them starting on an aligned offset, and only
+    their offsets and sizes are stored in front of the pickle, together with the size of the sidecar
+    and a random token written at its start, so that pload() can tell if both files belong together.
     input:
         - self: catalog instance"""
     assert cf.use_pickle, "Pickle isn't activated"
     import pickle
-    with open(paths.join('load', file_pickle), 'wb') as f:
-        pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+    buffers = []
+    payload = pickle.dumps(self, protocol=5, buffer_callback=buffers.append)
+    # The arrays of a loaded catalog are mapped on the old sidecar file (on POSIX systems, see
+    # map_buffers), so it must not be overwritten in place: both files are written aside and then
+    # moved over the old ones, the pickle last. An interrupted save leaves either the old pair or
+    # a mismatch pload() detects.
+    path_buffers = paths.join('load', file_buffers)
+    path_pickle = paths.join('load', file_pickle)
+    token = buffers_magic + os.urandom(16)
+    spans = []
+    offset = len(token)
+    with open(path_buffers+'.tmp', 'wb', buffering=pickle_buffering) as f:
+        f.write(token)
+        for buf in buffers:
+            raw = buf.raw()
+            pad = -offset % buffer_alignment
+            f.write(bytes(pad))
+            spans.append((offset+pad, raw.nbytes))
+            f.write(raw)
+            offset += pad + raw.nbytes
+    with open(path_pickle+'.tmp', 'wb', buffering=pickle_buffering) as f:
+        pickle.dump({'token': token, 'size': offset, 'spans': spans}, f, protocol=5)
+        f.write(payload)
+    os.replace(path_buffers+'.tmp', path_buffers)
+    os.replace(path_pickle+'.tmp', path_pickle)
     return None
 
 def pload():
     """Function that loades the pickle representation of the catalog class from the cwd.
+    The pickle is read from a memory map of the file, so no read buffer is copied in between.
+    On POSIX systems the sidecar file of raw arrays is memory-mapped (copy-on-write) as well, so the
+    spectra arrays are built on top of the mapped pages instead of being copied from the pickle.
+    Elsewhere it is read into memory, so that psave() can replace it later.
+    Catalogs pickled in band by older versions (a lone spcat.pickle) are still loaded.
+    Raises IOError if the sidecar file is missing or doesn't belong to the pickle (e.g. after an interrupted save).
     output:
         - class"""
     assert cf.use_pickle, "Pickle isn't activated"
     import pickle
+    import mmap
     with open(paths.join('load', file_pickle), 'rb') as f:
-        data = pickle.load(f)
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    with mm:
+        header = pickle.load(mm)
+        if isinstance(header, dict):
+            token = header['token']
+            view = memoryview(b'')
+            try:
+                with open(paths.join('load', file_buffers), 'rb') as b:
+                    nbytes = os.fstat(b.fileno()).st_size
+                    if nbytes > 0 and map_buffers:
+                        view = memoryview(mmap.mmap(b.fileno(), 0, access=mmap.ACCESS_COPY))
+                    elif nbytes > 0:
+                        view = memoryview(bytearray(nbytes))
+                        b.readinto(view)
+            except FileNotFoundError:
+                pass
+            matching = view[:len(token)] == token and view.nbytes == header['size']
+            if not matching:
+                raise IOError('{} is missing or does not belong to {}: the catalog was not saved properly. Save it again or delete both files.'.\
+                    format(file_buffers, file_pickle))
+            buffers = [view[start:start+size] for start, size in header['spans']]
+            data = pickle.Unpickler(mm, buffers=buffers).load()
+        else:
+            # Old in-band catalog: the whole thing was the first (and only) pickle.
+            data = header
     print('Catalog imported.\nDate of creation: {}\nDate of last modification: {}'.\
         format(data.date_created, data.date_modified))
     return data
 
+def pprefetch():
+    """Function that starts reading the catalog files into the page cache, so that a later pload() finds
+    them in memory. It returns at once: the disk is read while the user answers the load prompt.
+    Where posix_fadvise is not available, a background thread reads the files through instead."""
+    files = [paths.join('load', f) for f in (file_pickle, file_buffers) if paths.isfx(f, 'load')]
+    if hasattr(os, 'posix_fadvise'):
+        for file in files:
+            try:
+                fd = os.open(file, os.O_RDONLY)
+                try:
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+                finally:
+                    os.close(fd)
+            except OSError:
+                #It is only a hint: the files will be read by pload() anyway.
+                pass
+        return None
+    import threading
+    def readthrough():
+        for file in files:
+            with open(file, 'rb', buffering=0) as f:
+                while f.read(pickle_buffering):
+                    pass
+    threading.Thread(target=readthrough, daemon=True).start()
+    return None
+
 
 def ImportFile(file, check=False):
     """Function that loads a single file of raw data and returns an array of its content.
@@ -216,6 +314,7 @@ def ImportData(directory=None):
         - isotdict: dictionary of Isotopes
         - elemdict: dictionary of Elements
         - compdict: dictionary of Compounds"""
+    from tqdm import tqdm
     from .spectra_Objects import Isotope, Element, Compound
 
     isotdict = dict()
@@ -225,7 +324,7 @@ def ImportData(directory=None):
     path_peaks = paths.join('load', file_peaks_nonhuman)
     
     if paths.isfx(file_peaks_nonhuman, 'load'):
-        inp = input('Import peak properties from file? ([y]/n) >')
+        inp = basics.Ask('Import peak properties from file? ([y]/n) >', 'y')
         if inp in ans_quit:
             return dict(),dict(),dict()
         elif not inp in ans_no:
@@ -294,6 +393,7 @@ def ImportSamp(skipping=-1, skip_list=None):
         - skip_list: list of files that will be ignored
     output:
         - sampdict: dictionary of Samples"""
+    from tqdm import tqdm
     from .spectra_Objects import Sample
 
     sampdict = dict()
@@ -311,12 +411,12 @@ def ImportSamp(skipping=-1, skip_list=None):
         skipping = 0
     else:
         if skipping == -1:
-            skipping = int(input('Skip existing samples? ([y]/n) >') not in ans_no)
+            skipping = int(basics.Ask('Skip existing samples? ([y]/n) >', 'y') not in ans_no)
     
     assert skipping in [0, 1], 'Bad skipping value'
 
     naming = False
-    inp = input('Name manually? (y/[n]) >')
+    inp = basics.Ask('Name manually? (y/[n]) >', 'n')
     if inp in ans_yes:
         naming = True
     elif inp in ans_quit:
@@ -493,7 +593,7 @@ def MixOut(Dict, container_in):
 
 def MixInFile(filepath, Dict, permitted, kind=None):
     """Reads a single file, either Natural_in, or Compounds_in."""
-    from .spectra_Objects import Isotope, Element, Compound
+    from .spectra_Objects import Element, Compound
     dictout = dict()
     dictcomp = dict()
         
@@ -501,8 +601,8 @@ def MixInFile(filepath, Dict, permitted, kind=None):
         print('File does not exist')
         return dict()
     else:
-        if not input('Importing\n"'+filepath+'"\nContinue?\n'\
-                     'Note: this is likely to take a while. ([y]/n) >') not in ans_no: return dict()
+        if not basics.Ask('Importing\n"'+filepath+'"\nContinue?\n'\
+                          'Note: this is likely to take a while. ([y]/n) >', 'y') not in ans_no: return dict()
     
     mixels = []
     mixname = ""
@@ -604,14 +704,16 @@ def ExportWeighted(*args, directory=None):
 def infoone(isot):
     """Given a Data instance, squishes all the information that goes into human-readable files out of it."""
     linesout = []
+    #ToF of all the centers converted at once.
+    tofs = basics.E2t(np.array([isot.peaks[peak].center for peak in range(len(isot.peaks))], dtype=float), isot.mode).tolist()
+    lineformat = '{:>4d}{:1s} {:>10.3e} {:^6s} {:<10.3e} {:10.3e} {:10.3e} {:<6s} {:10.3e} {:<6s}'.format
     for peak in range(len(isot.peaks)):
         line = isot.peaks[peak]
-        linesout.append('{:>4d}{:1s} {:>10.3e} {:^6s} {:<10.3e} {:10.3e} {:10.3e} {:<6s} {:10.3e} {:<6s}'.\
-                    format( line.num,\
+        linesout.append(lineformat( line.num,\
                             '*' if line.integral == 0 else '',\
                             line.center,\
                             '('+str(line.center_)+')',\
-                            basics.E2t(line.center,isot.mode),\
+                            tofs[peak],\
                             line.integral,\
                             line.width,\
                             '('+str(line.width_)+')',\
@@ -1,6 +1,6 @@
 import numpy as np
 from . import spectra_Basics as basics
-from .spectra_InitSettings import cf, err
+from .spectra_InitSettings import cf
 
 def Query(askmode=cf.ask_mode):
     """Basically, asks the user what to look up.
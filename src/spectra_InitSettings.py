@@ -1,3 +1,6 @@
+import numpy as np
+
+
 class Settings:
     def __init__(self):
         from ..settings import parameters
@@ -24,10 +27,20 @@ class Settings:
     def L0(self,mode=None):
         if mode is None: mode = self.default_mode
         return self.L0_g if mode=='n-g' else (self.L0_t if mode=='n-tot' else None)
-    def E2t(self,En,mode=None):
-        return self.L0(mode)*1E6*(0.5*self.mn/(self.e*En))**0.5
-    def t2E(self,t,mode=None):
-        return 0.5*(self.mn/self.e)*((self.L0(mode)*1E6)/t)**2
+    def E2t(self,En,mode=None,out=None):
+        if np.ndim(En) == 0 or not isinstance(En, np.ndarray):
+            return self.L0(mode)*1E6*(0.5*self.mn/(self.e*En))**0.5
+        #Same operations in the same order, evaluated in place over a single buffer (out, if given).
+        out = np.multiply(self.e, En, out=out)
+        np.divide(0.5*self.mn, out, out=out)
+        np.sqrt(out, out=out)
+        return np.multiply(self.L0(mode)*1E6, out, out=out)
+    def t2E(self,t,mode=None,out=None):
+        if np.ndim(t) == 0 or not isinstance(t, np.ndarray):
+            return 0.5*(self.mn/self.e)*((self.L0(mode)*1E6)/t)**2
+        out = np.divide(self.L0(mode)*1E6, t, out=out)
+        np.square(out, out=out)
+        return np.multiply(0.5*(self.mn/self.e), out, out=out)
     def dt2dE(self,dt,t,mode=None):
         return 10**12*self.mn*self.L0(mode)**2/(self.e*t**3)*dt
     def dE2dt(self,dE,E,mode=None):
@@ -13,46 +13,88 @@ Created on Wed Jun 26 15:08:15 2019
 
 import os
 import sys
-from tqdm import tqdm
-from datetime import datetime
-import time
-import shutil
-import pickle
 
-import numpy as np
-import scipy.integrate as spint#
-import matplotlib.pyplot as plt
-
-from .spectra_Basics import isd, isf, isfx
+from .spectra_Basics import isd, IsTerminal, Ask
 from .spectra_Objects import Catalog
 from .spectra_InitSettings import cf, err, paths
-from .spectra_FileHandlers import pload
+from .spectra_FileHandlers import pload, pprefetch, file_pickle, file_buffers
 
-#This allows plots to be detached from the command line.
-plt.ion()
+#What to do with each answer to the load question. Any other answer loads the catalog.
+load_actions = {'n': Catalog, 'no': Catalog, 'q': lambda: None, 'quit': lambda: None}
 
-#Required directories:
+#Values of the NRCA_LOAD environment variable (lowercase) that answer the load question.
+load_env_yes = frozenset(('1', 'y', 'yes', 'true', 'on'))
+load_env_no = frozenset(('0', 'n', 'no', 'false', 'off'))
 
+#Command line flags that answer the load question.
+load_flags = frozenset(('--load', '--no-load'))
 
-assert isd('data'), 'Missing directory: {}'.format(paths.data)
+def LoadFlag():
+    """Answer to the load question given beforehand, if any: the --load/--no-load command line flags
+    (the last one given counts), or else the NRCA_LOAD environment variable (1/0, y/n, yes/no, true/false).
+    Only these exact tokens are looked for, as sys.argv belongs to whichever program imports the package.
+    An empty or unknown NRCA_LOAD value counts as not given.
+    output:
+        - str: 'y' or 'n', or None if no answer was given."""
+    flags = [arg for arg in getattr(sys, 'argv', []) if arg in load_flags]
+    if flags:
+        return 'y' if flags[-1] == '--load' else 'n'
+    env = os.environ.get('NRCA_LOAD', '').strip().lower()
+    if env in load_env_yes: return 'y'
+    if env in load_env_no: return 'n'
+    return None
 
-if not isd('output'):
-    os.mkdir(paths.output)
+def AskLoad(default='y'):
+    """Asks whether to load the catalog from file. The question is only asked on a terminal.
+    Otherwise (scripts, pipelines) the answer is taken from LoadFlag(), or else the default is taken.
+    The flags and the variable also skip the question on a terminal.
+    input:
+        - default: str
+            answer taken when none is given ('y' or 'n')
+    output:
+        - str: the answer, as typed by the user."""
+    inp = LoadFlag()
+    if inp is None:
+        inp = Ask('Load catalog from file? {} >'.format('([y]/n)' if default == 'y' else '(y/[n])'), default)
+    return inp if inp.strip() else default
 
-if not isd('input'):
-    os.mkdir(paths.input)
+def IsStale():
+    """Checks whether the saved catalog is older than the spectra in the data directory.
+    The catalog is as old as the older of its two files (the sidecar file is missing in old catalogs).
+    output:
+        - bool: True if any entry of the data directory was modified after the catalog was saved."""
+    files = [f for f in (file_pickle, file_buffers) if paths.isfx(f, 'load')]
+    pkl_mt = min(os.path.getmtime(paths.join('load', f)) for f in files)
+    with os.scandir(paths.path('data')) as entries:
+        data_mt = max((entry.stat().st_mtime for entry in entries), default=0)
+    return data_mt > pkl_mt
+
+#Required directories:
+#The missing ones are created, and existing ones are left untouched,
+#so that several sessions can be started at the same time.
+assert isd('data'), 'Missing directory: {}'.format(paths.data)
 
-if not isd('load'):
-    os.mkdir(paths.load)
+for d in ['output', 'input', 'load']:
+    os.makedirs(paths.path(d), exist_ok=True)
 
 #If 'spcat.pickle' pickle exists, ask.
 #Either load it or create the insntace
-if paths.isfx('spcat.pickle', 'load'):
-    inp = input('Load catalog from file? ([y]/n) >')
-    if not inp in ['n','no','q','quit']:
-        spcat = pload()
-    elif not inp in ['q','quit']:
+#A catalog older than the data files misses their changes, but keeps the edits stored in it:
+#on a terminal the user chooses (not loading it by default), scripts build a new one,
+#unless loading was asked for explicitly.
+if paths.isfx(file_pickle, 'load') and LoadFlag() is None and IsStale():
+    if IsTerminal():
+        print('The saved catalog is older than the data files. Loading it keeps its peak edits, but not the changes in the data files.')
+        spcat = load_actions.get(AskLoad('n').strip().lower(), pload)()
+    else:
+        print('The saved catalog is older than the data files. Creating a new catalog (use --load or NRCA_LOAD=1 to load it anyway).')
         spcat = Catalog()
+elif paths.isfx(file_pickle, 'load'):
+    #The files are read from disk while the question is being answered,
+    #unless loading was already refused.
+    if LoadFlag() != 'n':
+        pprefetch()
+    spcat = load_actions.get(AskLoad().strip().lower(), pload)()
 else:
     spcat = Catalog()
 
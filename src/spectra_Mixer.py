@@ -1,16 +1,8 @@
-import os
-import sys
-from tqdm import tqdm
-from datetime import datetime
 import time
-import shutil
 
 import numpy as np
-import scipy.integrate as spint
-import matplotlib.pyplot as plt
 
 from . import spectra_Basics as basic
-from .spectra_InitSettings import cf, err
 
 def Interpolate(arrayin,value):
     """Function that locates the value between to elements in an array and returns the linear interpolation."""
@@ -30,7 +22,6 @@ def GetWeighted(Dict,element,suf,composition):
         - element: name of the new mix
         - suf: suffix. Should be '_n-tot' or '_n-g'
         - composition: dictionary of abundances to weight the components (cookbook)."""
-    from .spectra_Objects import Isotope, Element, Compound
     components = dict()
 
     #The new mesh (x values) goes from the maximum x value amongst the first x values
@@ -1,13 +1,8 @@
-import os
-import sys
-from tqdm import tqdm
-from datetime import datetime
 import time
-import shutil
+from datetime import datetime
+from functools import cached_property
 
 import numpy as np
-import scipy.integrate as spint
-import matplotlib.pyplot as plt
 
 from . import spectra_Basics as basic
 from . import spectra_Plotters as plotter
@@ -183,25 +178,31 @@ class Catalog:
 
 class Summer:
     def __init__(self):
-        self.values = dict()
+        self.sums = dict()
         self.counts = dict()
         self.lists = dict()
 
     def append(self,key,amount):
-        if key not in self.values:
-            self.values[key] = 0
+        if key not in self.sums:
+            self.sums[key] = 0
             self.counts[key] = 0
             self.lists[key] = []
-        self.values[key] = (self.values[key]*self.counts[key] + amount)/(self.counts[key]+1)
+        self.sums[key] += amount
         self.counts[key] += 1
         self.lists[key].append(amount)
 
+    @property
+    def values(self):
+        #Mean of every key, from its running sum.
+        return {key: self.sums[key]/self.counts[key] for key in self.sums}
+
     def get_as_dict(self):
         return self.values
 
     def get_as_lists(self):
-        keys = [key for key in sorted(self.values)]
-        return keys, [self.values[key] for key in keys]
+        values = self.values
+        keys = [key for key in sorted(values)]
+        return keys, [values[key] for key in keys]
 
     def get_all(self):
         return self.lists
@@ -214,8 +215,10 @@ class Summer:
 
     def percentage(self, outof100=False, decimals=None):
         outp = {}
-        for key in self.values:
-            res = self.values[key]/self.sum()
+        values = self.values
+        total = self.sum()
+        for key in values:
+            res = values[key]/total
             if outof100: res = res*100
             if not decimals is None: res = np.round(res,decimals)
             outp[key] = res
@@ -224,16 +227,22 @@ class Summer:
 class Substance:
     def __init__(self,namestr,array):
         self.fullname = namestr
-        self.npeaks = np.shape(self.ma)[1]
-        self.der = np.array([(array[1,i+1]-array[1,i])/(array[0,i+1]-array[0,i]) for i in range(np.shape(array)[1]-1)])
+        self.npeaks = np.shape(self.ma_tof if self.intof else self.ma)[1]
+        self._setder(array)
+        self.date_created = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+
+    def _setder(self,array):
+        #The settings used are kept, so that recompute can tell when the derivatives are outdated.
+        self.dersettings = (cf.itersmooth, cf.maxleftslope)
+        self.der = np.diff(array[1])/np.diff(array[0])
         i0 = basic.GetIndex(np.int32(self.der<0),0)
         target = np.hstack((np.ones((i0)),np.zeros((np.size(self.der)-i0))))
         self.der = self.der*(np.int64(np.abs(self.der)<cf.maxleftslope)*target + (1-target))
         self.sder = basic.Smooth(self.der,cf.itersmooth)
-        self.date_created = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
         
     def plot(self,showlim=True,showma=True,tof=None,peaklabs=True):
         if tof is None: tof = self.intof
+        plt = plotter.pyplot()
         plt.figure()
         plotter.Plotter(self,self.fullname,showlim=showlim,showma=showma,tof=tof,peaklabs=peaklabs,axlabsin=False,vlines=None,ax=None)
         plt.show()
@@ -242,13 +251,81 @@ class Substance:
         if np.shape(arr)[0] < 2:
             return basic.t2E(arr, self.mode)
         else:
-            return np.vstack((basic.t2E(arr[0], self.mode), arr[1:]))
+            #Converted x row computed straight into the output, the other rows copied once.
+            out = np.empty(np.shape(arr))
+            out[1:] = arr[1:]
+            basic.t2E(arr[0], self.mode, out=out[0])
+            return out
 
     def arr_E2t(self, arr):
         if np.shape(arr)[0] < 2:
             return basic.E2t(arr, self.mode)
         else:
-            return np.vstack((basic.E2t(arr[0], self.mode), arr[1:]))
+            #Converted x row computed straight into the output, the other rows copied once.
+            out = np.empty(np.shape(arr))
+            out[1:] = arr[1:]
+            basic.E2t(arr[0], self.mode, out=out[0])
+            return out
+
+    def arr_shared(self, arr, tof):
+        """Converts an x-y array to the other domain, with both arrays sharing the same y row.
+        They are views of a single 3-row buffer (x, y, converted x), instead of two full copies.
+        inputs:
+            - arr: np.ndarray with the x-y values
+            - tof: bool
+                True to convert from energy to ToF, False from ToF to energy
+        outputs:
+            - arr and its conversion, as views of the buffer.
+              Arrays other than 2-row float64 ones are given back as they are, with a plain conversion."""
+        if not self.shareable(arr):
+            return arr, (self.arr_E2t(arr) if tof else self.arr_t2E(arr))
+        buffer = np.empty((3, np.shape(arr)[1]))
+        buffer[:2] = arr
+        (basic.E2t if tof else basic.t2E)(arr[0], self.mode, out=buffer[2])
+        return buffer[:2], buffer[2:0:-1]
+
+    @staticmethod
+    def shareable(arr):
+        """Whether arr_shared can put an array in a shared buffer: only 2-row float64 arrays."""
+        return np.shape(arr)[0] == 2 and arr.dtype == np.float64
+
+    def _setspectra(self, arr, buffer=None):
+        """Sets the spectrum the instance is built from and its conversion to the other domain (the attributes
+        named in spectra_attrs), as views of a single buffer (see arr_shared). They are only set here, so
+        references taken to either of them keep tracking the instance.
+        Arrays that can't be shared are set alone, and converted on first access (see spectrum_tof, spectrum).
+        inputs:
+            - arr: np.ndarray with the x-y values. Not used if buffer is given.
+            - buffer: np.ndarray
+                3-row buffer (x, y, converted x) of a pickled instance, whose views are taken as they are."""
+        source, converted, tof = self.spectra_attrs
+        if buffer is not None:
+            arr, conv = buffer[:2], buffer[2:0:-1]
+        elif self.shareable(arr):
+            arr, conv = self.arr_shared(arr, tof)
+            buffer = arr.base
+        self.spectra_buffer = buffer
+        setattr(self, source, arr)
+        if buffer is not None:
+            setattr(self, converted, conv)
+        else:
+            self.__dict__.pop(converted, None)
+
+    def __getstate__(self):
+        #The converted spectrum is a non-contiguous view that can't be pickled out of band,
+        #so the whole buffer is pickled instead of the two views, and __setstate__ takes them again.
+        source, converted, tof = self.spectra_attrs
+        state = self.__dict__.copy()
+        state.pop(converted, None)
+        if state.get('spectra_buffer') is not None: state.pop(source, None)
+        return state
+
+    def __setstate__(self, state):
+        #Catalogs saved before the buffer was pickled have the source spectrum only (or both, as full arrays).
+        state = dict(state)
+        buffer = state.pop('spectra_buffer', None)
+        self.__dict__.update(state)
+        self._setspectra(self.__dict__.get(self.spectra_attrs[0]), buffer)
 
     def arr_dt2dE(self):
         pass
@@ -256,10 +333,21 @@ class Substance:
     pick = func.pick
 
 class Data(Substance):
+    #Spectrum the instance is built from, its conversion, and whether it is converted to ToF (see _setspectra).
+    spectra_attrs = ('spectrum', 'spectrum_tof', True)
+
     def __init__(self,namestr,array,peaksdict=None,specific_settings=dict()):
         self.atom, self.symb, self.mass, self.mode = basic.InterpretName(namestr)
         self.intof = False
-        
+        self._setbounds(specific_settings)
+        self._setspectra(array)
+        self.xmagnitude = 'Energy (eV)'
+        self.ymagnitude = 'Cross Section (b)'
+        self.ma, self.mai = func.maxima(array, self.xbounds, self.ybounds, 0)
+        super().__init__(namestr,array)
+        self._setpeaks(peaksdict or func.propsisot(self, cf.pack(**specific_settings)))
+
+    def _setbounds(self,specific_settings):
         if specific_settings.get('tof') is not None:
             assert isinstance(specific_settings.get('tof'), tuple), 'tof argument must be tuple'
             assert len(specific_settings.get('tof')) == 2, 'tof argument must have size 2'
@@ -274,54 +362,119 @@ class Data(Substance):
             self.xbounds = cf.xbounds()
         
         self.ybounds = specific_settings.get('crs_min') or cf.ybounds(self.symb, self.mode)
-        self.spectrum = array
-        self.spectrum_tof = self.arr_E2t(self.spectrum)
-        self.xmagnitude = 'Energy (eV)'
-        self.ymagnitude = 'Cross Section (b)'
-        self.ma, self.mai = func.maxima(array, self.xbounds, self.ybounds, 0)
-        self.ma_tof = self.arr_E2t(self.ma)
-        super().__init__(namestr,array)
-        self.peaks = peaksdict or func.propsisot(self, cf.pack(**specific_settings))
+
+    def recompute(self,**kwargs):
+        """Computes the peaks again with specific settings, keeping the spectrum.
+        The derivatives are only built again if cf.itersmooth or cf.maxleftslope have changed,
+        and the maxima only searched again if the bounds have changed."""
+        if getattr(self, 'dersettings', None) != (cf.itersmooth, cf.maxleftslope): self._setder(self.spectrum)
+        bounds = (self.xbounds, self.ybounds)
+        self._setbounds(kwargs)
+        if (self.xbounds, self.ybounds) != bounds:
+            self.ma, self.mai = func.maxima(self.spectrum, self.xbounds, self.ybounds, 0)
+            self.__dict__.pop('ma_tof', None)
+        self.npeaks = np.shape(self.ma)[1]
+        self._setpeaks(func.propsisot(self, cf.pack(**kwargs)))
+        self.date_created = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+
+    @cached_property
+    def spectrum_tof(self):
+        """ToF spectrum of a spectrum that can't be shared (see _setspectra), converted on first access."""
+        return self.arr_E2t(self.spectrum)
+
+    @cached_property
+    def ma_tof(self):
+        return self.arr_E2t(self.ma)
+
+    @property
+    def date_edited(self):
+        """Date of the last edit of the peaks. Only a timestamp is kept, formatted when asked for."""
+        if 'date_edited_ts' in self.__dict__:
+            return datetime.fromtimestamp(self.date_edited_ts).strftime("%d/%m/%Y %H:%M:%S")
+        #Catalogs saved before the timestamp was kept have the date already formatted, if edited.
+        if 'date_edited' in self.__dict__: return self.__dict__['date_edited']
+        raise AttributeError("'{}' object has not been edited".format(type(self).__name__))
+
+    def _setpeaks(self,peaks):
+        #Every change of the peaks goes through here, so that the cached columns are dropped.
+        self.peaks = peaks
+        self.peaktable = dict()
         self._seterrors()
         
     def _seterrors(self):
-        self.errors = [self.peaks[i] for i in self.peaks if self.peaks[i].xlims == (0.,0.)]
+        #Peaks that could not be bounded have xlims (0.,0.), found at once in the cached xlims column.
+        if len(self.peaks) == 0:
+            self.errors = []
+            return
+        keys = sorted(self.peaks)
+        failed = np.all(np.reshape(self.get_from_peaks('xlims'), (len(keys), -1)) == (0.,0.), axis=1)
+        self.errors = [self.peaks[keys[i]] for i in np.flatnonzero(failed)]
 
     def infopeaks(self):
         from .spectra_FileHandlers import infoone
-        print()
-        print(self.fullname, 'PEAKS:','='*56)
-        print('{:>4s}  {:>10s}        {:<10s} {:>10s} {:>17s} {:>17s}\n'.\
-                    format('Rk.','Energy (eV)', 'TOF (us)', 'Integral','Peak width','Peak height'))
-        for line in infoone(self): print(line)
-        print('='*78)
-        print()
+        #The whole table is joined and printed at once.
+        print('\n'.join(['', self.fullname+' PEAKS: '+'='*56,
+                    '{:>4s}  {:>10s}        {:<10s} {:>10s} {:>17s} {:>17s}\n'.\
+                    format('Rk.','Energy (eV)', 'TOF (us)', 'Integral','Peak width','Peak height')]
+                    + infoone(self) + ['='*78, '']))
     
     def plotsingle(self,num):
+        plt = plotter.pyplot()
         plt.figure()
         plotter.plotone(self,num,title='{} #{}'.format(self.fullname, num))
         plt.show()
 
     def get_from_peaks(self,attr):
-        if peakattr.has(attr): return np.array([getattr(self.peaks[i],attr) for i in sorted(self.peaks)])
+        """Array with the values of a peak attribute, one per peak in rank order.
+        Columns are built once and cached in self.peaktable (read-only), until the peaks change."""
+        if not peakattr.has(attr): return None
+        #Catalogs saved before the cache existed don't have it.
+        table = self.__dict__.setdefault('peaktable', dict())
+        if attr not in table:
+            table[attr] = np.array([getattr(self.peaks[i],attr) for i in sorted(self.peaks)])
+            table[attr].setflags(write=False)
+        return table[attr]
 
     def getclosest(self,inp,in_tof=True):
-        malist = self.get_from_peaks('ma_tof') if not in_tof else self.get_from_peaks('ma')
+        """Peak closest to a position, by binary search over the peak positions.
+        inputs:
+            - inp: float or np.ndarray
+                position(s) to look around
+            - in_tof: bool
+                whether inp is a ToF (True) or an energy (False)
+        outputs:
+            - tuple: peak number(s) and distance(s) to inp, or None if there are no peaks"""
+        attr = 'center_tof' if in_tof else 'center'
+        malist = self.get_from_peaks(attr)
+        if np.size(malist) == 0: return None
+        #Peaks are ranked by integral, so the position order is cached next to the columns.
+        table = self.peaktable
+        if 'order_'+attr not in table:
+            table['order_'+attr] = np.argsort(malist, kind='stable')
+            table['sorted_'+attr] = malist[table['order_'+attr]]
+        order, positions = table['order_'+attr], table['sorted_'+attr]
+        inp = np.asarray(inp)
+        idx = np.searchsorted(positions, inp).clip(1, max(len(positions)-1, 1))
+        if len(positions) > 1: idx = idx - ((inp-positions[idx-1]) <= (positions[idx]-inp))
+        else: idx = idx - 1
+        npeak = order[idx]
+        dist = np.abs(malist[npeak]-inp)
+        if np.ndim(inp) == 0: return int(npeak), dist[()]
+        return npeak, dist
 
     def edit(self):
         editing = func.EditPeaks(self)
         if editing != dict():
-            self.peaks = func.propsisot(self, cf.pack(), setx=editing)
-            self._seterrors()
-            self.date_edited = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+            self._setpeaks(func.propsisot(self, cf.pack(), setx=editing))
+            self.date_edited_ts = time.time()
 
     def delete(self):
         deleting = func.DeletePeaks(self)
         if deleting != []:
-            self.peaks = func.sorting({i: self.peaks[i] for i in self.peaks if not i in deleting})
-            self.npeaks = len(self.peaks)   
-            self._seterrors()
-            self.date_edited = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+            deleting = frozenset(deleting)
+            self._setpeaks(func.sorting([peak for i, peak in self.peaks.items() if not i in deleting]))
+            self.npeaks = len(self.peaks)
+            self.date_edited_ts = time.time()
 
 
     plotpeaks = plotter.plotpeaks
@@ -334,11 +487,6 @@ class Mix(Data):
         self.abundances = abund
         self.components = list(abund.keys())
 
-    def recompute(self,**kwargs):
-        self.__init__(self.fullname, self.spectrum, self.abundances, None, kwargs)
-        #self.peaks = propsisot(self, cf.pack(**kwargs))
-        #self.err = [self.peaks[i] for i in self.peaks if self.peaks[i].xlims == (0.,0.)]
-
 class Element(Mix):
     kind = 'element'
     def __init__(self,namestr,array,abund,peaksdict=None, specific_settings=dict()):
@@ -354,38 +502,63 @@ class Isotope(Data):
     def __init__(self,namestr,array,peaksdict=None, specific_settings=dict()):
         super().__init__(namestr,array,peaksdict,specific_settings)
 
-    def recompute(self,**kwargs):
-        self.__init__(self.fullname, self.spectrum, None, kwargs)
-        #self.peaks = propsisot(self, cf.pack(**kwargs))
-        #self.err = [self.peaks[i] for i in self.peaks if self.peaks[i].xlims == (0.,0.)]
-
 class Sample(Substance):
     kind = 'sample'
+    spectra_attrs = ('spectrum_tof', 'spectrum', False)
+
     def __init__(self,namestr,arrayin,mode=None,filename=""):
         self.filename = filename
         self.intof = True
         self.xbounds = None
         self.ybounds = None
-        if mode is None:
-            inp = input('Mode for {}: (1: n-g; 2: n-tot) >'.format(namestr))
-            self.mode = {'1':'n-g', '2':'n-tot'}.get(inp,cf.default_smode)
-            del inp
-        else:
-            self.mode = mode
-        self.spectrum_tof = arrayin
-        self.spectrum = self.arr_t2E(self.spectrum_tof)
+        #No prompting here, so that samples can be built unattended. See Sample.interactive.
+        if mode is None: raise ValueError('Mode for sample {} must be given (n-g or n-tot)'.format(namestr))
+        self.mode = mode
+        self._setspectra(arrayin)
         self.xmagnitude = 'ToF (us)'
         self.ymagnitude = 'Counts'
         self.ma_tof, self.mai_tof = func.maxima(arrayin, None, None, cf.itersmoothsamp)
-        self.ma = self.arr_t2E(self.ma_tof)
         super().__init__(namestr,arrayin)
         func.sampprocess(self)
 
+    @classmethod
+    def interactive(cls,namestr,arrayin,filename=""):
+        """Builds a Sample asking for its mode at the command line.
+        inputs:
+            - namestr, arrayin, filename: as in Sample
+        outputs:
+            - Sample instance"""
+        inp = input('Mode for {}: (1: n-g; 2: n-tot) >'.format(namestr))
+        return cls(namestr, arrayin, {'1':'n-g', '2':'n-tot'}.get(inp,cf.default_smode), filename)
+
+    @cached_property
+    def spectrum(self):
+        """Energy spectrum of a spectrum that can't be shared (see _setspectra), converted on first access."""
+        return self.arr_t2E(self.spectrum_tof)
+
+    @cached_property
+    def ma(self):
+        return self.arr_t2E(self.ma_tof)
+
 class Peak:
     kind = 'peak'
-    def __init__(self,info):
-        assert len(info) == peakattr.size, 'info tuple must have the same lenght as peakattr, but' + len(info) +' / '+ peakattr.size
-        for i in range(peakattr.size):
-            setattr(self,peakattr.get(i),info[i])
+    #Catalogs hold thousands of peaks, so their attributes live in slots instead of a __dict__.
+    __slots__ = tuple(peakattr.getlist())
+    #__init__(self,info) is generated right below the class.
+
+    def __setstate__(self,state):
+        #Peaks pickled before the slots were added come with a plain dict.
+        if isinstance(state, tuple): state = state[1]
+        for attr in state:
+            setattr(self,attr,state[attr])
+
+    pick = func.pick
 
-    pick = func.pick
\ No newline at end of file
+#The peak attributes are fixed, so Peak.__init__ is written once for them: info is unpacked into all the slots at once.
+_peakinit = {}
+exec('def __init__(self,info):\n'
+     '    assert len(info) == {0}, "info tuple must have the same length as peakattr ({0})"\n'
+     '    {1} = info\n'.format(peakattr.size, ', '.join('self.'+attr for attr in Peak.__slots__)), _peakinit)
+Peak.__init__ = _peakinit['__init__']
+Peak.__init__.__qualname__ = 'Peak.__init__'
+del _peakinit
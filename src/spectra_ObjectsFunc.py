@@ -6,14 +6,61 @@ Created on Wed Oct  7 11:48:50 2020
 @author: ivan
 """
 
+from operator import attrgetter
+from functools import cached_property
+
 import numpy as np
-import matplotlib.pyplot as plt
-import scipy.integrate as spint
 
 from . import spectra_Basics as basic
 from . import spectra_Plotters as plotter
 from . import spectra_Finders as finder
-from .spectra_InitSettings import cf, peakattr, err
+from .spectra_InitSettings import cf, err
+
+
+def scanpeak(sder,der,center,prange,outerslope,slopedrop):
+    """Scans the derivative to the left and to the right of a peak center looking for its boundaries.
+    It is a plain loop over the arrays that stops at each boundary, called once per direction by definepeak.
+    Only arrays and numbers go in and out, so it can be timed on its own (or compiled, if a JIT is ever added).
+    inputs:
+        - sder: np.ndarray
+            smoothed derivative
+        - der: np.ndarray
+            derivative
+        - center: int
+            peak center (index)
+        - prange: int
+            range in number of points to each side
+        - outerslope: float
+        - slopedrop: float
+    outputs:
+        - ilims: list [int, int]
+            left and right boundary indices, None when not found
+        - peakr: list [int, int]
+            left and right stopping reasons (see definepeak), 0 when not found"""
+    ilims = []
+    peakr = []
+    #The walk stops as soon as a boundary is found, usually a few steps after the lock.
+    for sign in [-1,1]:
+        dermax = None
+        for i in range(center,center+sign*(prange+1),sign):
+            here, ahead = sder[i], sder[i+sign]
+            #Lock at the first step where the smoothed derivative decreases (left) or increases (right).
+            if dermax is None and (ahead < here if sign==-1 else ahead > here):
+                dermax = here
+                if dermax == outerslope: raise Exception('Non-standing slope',prange)
+            if dermax is not None:
+                if abs((der[i]-outerslope)/(dermax-outerslope)) <= slopedrop:
+                    peakr.append(1)
+                    ilims.append(i)
+                    break
+                if ahead*here <= 0:
+                    peakr.append(2)
+                    ilims.append(i)
+                    break
+        else:
+            ilims.append(None)
+            peakr.append(0)
+    return ilims, peakr
 
 def definepeak(self,npeak,prange,params):
     """Given an Data instance, defines the npeak-th peak in x position.
@@ -61,38 +108,12 @@ def definepeak(self,npeak,prange,params):
         #Center and redder (reduced derivative), i.e. smoothed derivative in a neighbourhood defined by prange
         center = self.mai[npeak]
         redder = self.sder[center-prange:center+prange+1]
-        for i in range(1,10):
-            fit,boxwidth = basic.FitBoxes(redder,params['dboxes']*i)
-            temp1,temp2 = np.unique(fit,return_counts=True)
-            if not (temp2==1).all(): break
-        outerslope = temp1[np.argmax(temp2)]
+        outerslope,boxwidth = basic.BoxMode(redder,params['dboxes'],9)
         if abs(outerslope) > params['maxouterslope']: outerslope = 0
-        outp_i = []
-        outp_e = []
-        peakr = []
-
-        for sign in [-1,1]:
-            decreasing, increasing, lock = False, False, False
-            dermax = None
-            for i in range(center,center+sign*(prange+1),sign):
-                decreasing = self.sder[i+sign]<self.sder[i]
-                increasing = self.sder[i+sign]>self.sder[i]
-                if not lock:
-                    if (decreasing if sign==-1 else increasing):
-                        lock = True
-                        dermax = self.sder[i]
-                        if dermax == outerslope: raise Exception('Non-standing slope',prange)
-                if lock:
-                    if abs((self.der[i]-outerslope)/(dermax-outerslope)) <= params['slopedrop']:
-                        peakr.append(1)
-                        outp_i.append(i)
-                        outp_e.append(self.spectrum[0,i])
-                        break
-                    if self.sder[i+sign]*self.sder[i] <= 0:
-                        peakr.append(2)
-                        outp_i.append(i)
-                        outp_e.append(self.spectrum[0,i])
-                        break
+        ilims, peakr = scanpeak(self.sder,self.der,center,prange,outerslope,params['slopedrop'])
+        outp_i = [i for i in ilims if i is not None]
+        outp_e = [self.spectrum[0,i] for i in outp_i]
+        peakr = [r for r in peakr if r]
 
         if np.size(outp_e)!=2 or np.size(outp_i)!=2: raise Exception('Unable to Define Peak',prange)
         if outp_e[0] == outp_e[1]: raise Exception('Zero-width peak',prange)
@@ -102,7 +123,7 @@ def definepeak(self,npeak,prange,params):
         return (0.,0.), (0,0), (0.,0.), (0,0)
 
 def Integrate(array,iedges):
-    """Integrates an x-y array between two given indices with simpson, and subtracting the background
+    """Integrates an x-y array between two given indices with simpson (basic.Simpson), and subtracting the background
     assuming a trapezoid.
     inputs:
         - array: np.ndarray
@@ -113,12 +134,14 @@ def Integrate(array,iedges):
         Integral minus background."""
     listx = array[0,iedges[0]:iedges[1]+1]
     listy = array[1,iedges[0]:iedges[1]+1]
-    raw_int = spint.simps(listy,listx)
+    raw_int = basic.Simpson(listy,listx)
     background = 0.5*(array[0,iedges[1]]-array[0,iedges[0]])*(array[1,iedges[1]]+array[1,iedges[0]])
     return raw_int-background
 
 def Fwhm(array,ic,coords,ilims):
     """Computes the Full Width at Half of Maximum (FWHM) of a peak.
+    On each side of the center, the crossing of the half maximum closest to the center is looked for,
+    and its x value is linearly interpolated between the two points around it.
     inputs:
         - array:
         - ic: int
@@ -132,11 +155,16 @@ def Fwhm(array,ic,coords,ilims):
             FWHM. Zero in case of miscalculation."""
     yhm = coords[1]/2
     i0,i1 = ilims[0],ilims[1]
-    iredhm1 = basic.InBetween(array[1,i0:ic],yhm,True)[0]
-    iredhm2 = basic.InBetween(array[1,ic:i1+1],yhm,True)[1]
-    xhm1 = array[0,iredhm1+i0] if not iredhm1 is None else None
-    xhm2 = array[0,iredhm2+ic] if not iredhm2 is None else None
-    return xhm2 - xhm1 if (( not xhm1 is None ) and (not xhm2 is None)) else 0
+    xhm = []
+    #Left side: last crossing before the center. Right side: first crossing after it.
+    for lo, hi, side in ((i0, ic+1, -1), (ic, i1+1, 0)):
+        dy = array[1,lo:hi] - yhm
+        cross = np.flatnonzero(dy[:-1]*dy[1:] <= 0)
+        if np.size(cross) == 0: return 0
+        j = cross[side]
+        t = dy[j]/(dy[j]-dy[j+1]) if dy[j] != dy[j+1] else 0.
+        xhm.append(array[0,lo+j] + t*(array[0,lo+j+1]-array[0,lo+j]))
+    return xhm[1] - xhm[0]
 
 def computepeak(self,peakpos,prange,params,setx=None):
     """Computes every peak parameter, sets up the tuple of them, and creates the
@@ -153,11 +181,11 @@ def computepeak(self,peakpos,prange,params,setx=None):
     from .spectra_Objects import Peak
     
     try:
-        center = self.ma[0,peakpos]
-        coords = tuple(self.ma[:,peakpos])
-        coords_tof = tuple((basic.E2t(coords[0]), coords[1]))
+        #The maxima are already converted to ToF (ma_tof), only the peak column is read.
+        center, height_ma = coords = tuple(self.ma[:,peakpos])
+        coords_tof = (basic.E2t(center), height_ma)
         icenter= self.mai[peakpos]
-        center_tof = basic.E2t(center,self.mode)
+        center_tof = self.ma_tof[0,peakpos]
 
         # If setx is None, we are computing. Otherwise, we com from the editing function.
         if setx is None:
@@ -175,7 +203,7 @@ def computepeak(self,peakpos,prange,params,setx=None):
         integral_tof = -Integrate(self.spectrum_tof,ilims) if successful else 0
         yvals = tuple(self.spectrum[1,ilims]) if successful else 0
         width = xlims[1]-xlims[0] if successful else -1
-        height = self.ma[1,peakpos]-(yvals[1]+yvals[0])/2 if successful else -1
+        height = height_ma-(yvals[1]+yvals[0])/2 if successful else -1
         fwhm = Fwhm(self.spectrum,icenter,coords,ilims) if successful else 0
         #Keep calm: big tuple.
         #Rank entries are set to -1 to show that are still unknown.
@@ -217,6 +245,19 @@ def computepeak(self,peakpos,prange,params,setx=None):
         return Peak(info)
 
 
+def BoundsWindow(arr,xbounds=None):
+    """Slice of the array to look for extrema in, so that the points outside xbounds are not scanned.
+    inputs:
+        - arr: array with the x-y values
+        - xbounds: None or tuple
+    outputs:
+        - slice"""
+    if xbounds is None: return slice(0, np.shape(arr)[1])
+    inside = np.flatnonzero((arr[0]>=xbounds[0]) & (arr[0]<=xbounds[1]))
+    #A single point has no extrema
+    if np.size(inside) == 0: return slice(0, 1)
+    return basic.ExtremaWindow(arr[1], inside[0], inside[-1])
+
 def maxima(arr,xbounds=None,ybounds=None,smoothing=0):
     """Looks for local maxima in the array, restricted to the bounds set.
     input:
@@ -234,28 +275,32 @@ def maxima(arr,xbounds=None,ybounds=None,smoothing=0):
 
     arr = basic.Smooth(arr,smoothing)
 
-    # First we look for maxima candidates
-    imax = basic.IndMaxima(arr[1,:])
+    # First we look for maxima candidates, only around the points within xbounds
+    window = BoundsWindow(arr,xbounds)
+    imax = basic.IndMaxima(arr[1,window]) + window.start
     cmaxima = arr[:,imax]
 
-    #Array of booleans. Do the peaks in cmaxima accomplish the condition for x and y?
-    condx = np.array(cmaxima[0]>=xbounds[0]) * np.array(cmaxima[0]<=xbounds[1]) if not xbounds is None else np.ones(np.shape(cmaxima)[1])
-    condy = cmaxima[1]>=ybounds if not ybounds is None else np.ones(np.shape(cmaxima)[1])
+    #Mask of booleans. Do the peaks in cmaxima accomplish the condition for x and y?
+    mask = np.ones(np.shape(cmaxima)[1], dtype=bool)
+    if not xbounds is None: mask &= (cmaxima[0]>=xbounds[0]) & (cmaxima[0]<=xbounds[1])
+    if not ybounds is None: mask &= cmaxima[1]>=ybounds
 
     # We peak the ones that do from the maxima candidates array.
-    cmaxima = cmaxima[:,np.nonzero(condx*condy)[0]]
-    imaxima = basic.GetIndex(arr[0],cmaxima[0],False)
+    cmaxima = cmaxima[:,mask]
+    imaxima = imax[mask]
     return cmaxima,imaxima
 
 def minima(arr,xbounds=None,ybounds=None,smoothing=0):
     """Looks for local minima in the array, restricted to the boudns set.
     Exactly the same as maxima(). Look for that documentation."""
-    imin = basic.IndMaxima(arr[1,:], -1)
+    window = BoundsWindow(arr,xbounds)
+    imin = basic.IndMaxima(arr[1,window], -1) + window.start
     cminima = arr[:,imin]
-    condx = np.array(cminima[0]>=xbounds[0]) * np.array(cminima[0]<=xbounds[1]) if not xbounds is None else np.ones(np.shape(cminima)[1])
-    condy = cminima[1]<=ybounds if not ybounds is None else np.ones(np.shape(cminima)[1])
-    cminima = cminima[:,np.nonzero(condx*condy)[0]]
-    iminima = basic.GetIndex(arr[0],cminima[0],False)
+    mask = np.ones(np.shape(cminima)[1], dtype=bool)
+    if not xbounds is None: mask &= (cminima[0]>=xbounds[0]) & (cminima[0]<=xbounds[1])
+    if not ybounds is None: mask &= cminima[1]<=ybounds
+    cminima = cminima[:,mask]
+    iminima = imin[mask]
     return cminima,iminima
 
 def propsisot(self,params,setx=dict()):
@@ -270,28 +315,23 @@ def propsisot(self,params,setx=dict()):
     outputs:
         - sorted dictionary of peaks."""
     peaks_pos = {}
-    for i in range(np.size(self.mai)):
+    #The pranges of all the peaks are computed at once.
+    nmai = np.size(self.mai)
+    nspec = np.shape(self.spectrum)[1]
+    if nmai > 1:
+        # Number of points at the left and at the right of each peak
+        nleft = self.mai
+        nright = nspec - self.mai - 1
+        # Take as prange the minimum between prangemax, and number of points to the left and to the right
+        pranges = np.minimum(np.minimum(params['prangemax'], nleft), nright)
+        # If it's in between, add in the minimum the number of points between the next and the previous point
+        pranges[1:-1] = np.minimum(pranges[1:-1], self.mai[2:]-self.mai[:-2])
+        pranges = pranges.tolist()
+    elif nmai == 1:
+        pranges = [min(self.mai[0]-1,nspec-self.mai[-1]-1,params['prangemax'])]
+    for i in range(nmai):
         try:
-            # Number of points at the left of the current peak
-            nleft = self.mai[i]
-            # Number of points at the right of the current peak
-            nright = np.shape(self.spectrum)[1] - self.mai[i] - 1
-            
-            if np.size(self.mai) > 1:
-                # If it's the first or last peak, take as prange the minimum between prangemax, and
-                # number of points to the left and to the right
-                if i == 0:
-                    prange = min(params['prangemax'], nleft, nright)
-                elif i == np.size(self.mai)-1:
-                    prange = min(params['prangemax'], nleft, nright)
-                # If it's in between, add in the minimum the number of points between the next and the previous point
-                else:
-                    prange = min(params['prangemax'],self.mai[i+1]-self.mai[i-1],nleft,nright)
-            elif np.size(self.mai) == 1:
-                prange = min(self.mai[0]-1,np.shape(self.spectrum[1])-self.mai[-1]-1,params['prangemax'])
-            else:
-                prange = 0
-            peaks_pos[i] = computepeak(self,i,prange,params,setx.get(i))
+            peaks_pos[i] = computepeak(self,i,pranges[i],params,setx.get(i))
         except Exception as e:
             err.add(e,'propsisot',self.fullname,i)
             continue
@@ -301,37 +341,31 @@ def propsisot(self,params,setx=dict()):
 def sorting(inp):
     """Function that ranks the rankable parameters, and orders the peaks so that they become label-ranked by intensity.
     input:
-        -inp: dictionary of unsorted peaks.
+        -inp: dictionary or list of unsorted peaks.
     output:
         - dictionary of sorted peaks with rank parameters set and ready."""
 
-    peaks = list(inp.values())
+    peaks = list(inp.values() if isinstance(inp, dict) else inp)
 
     #Build and array where each column correspond to an instance and each row to a property.
-    array = np.empty((6,0))
-    for el in peaks:
-        array = np.append(array, np.array([el.integral, el.width, el.height, el.fwhm, el.ahh, el.ahw]).reshape(6,1),axis=1)
+    getter = attrgetter('integral', 'width', 'height', 'fwhm', 'ahh', 'ahw')
+    array = np.array([getter(el) for el in peaks], dtype=np.float64).reshape(-1,6).T
     
-    #Index i points at the position in peaks whose rank is the #i
-    integral_sorting = (-array).argsort()[0]
-    #For each row (parameter): index i gives the #rank that peak position i has.
-    ranks = (-array).argsort().argsort()
-
-#   Alternative (probably faster) method (problem: within same integral val., order is backwards in peak position):
-#   integral_sorting = np.flip(array.argsort(),axis=1)[0]
-#   ranks = np.flip(array.argsort(),axis=1).argsort()
+    #For each row (parameter): index i points at the position in peaks whose rank is the #i
+    #(stable sort: peaks with the same value keep their order in position)
+    order = (-array).argsort(axis=1, kind='stable')
+    #Index i points at the position in peaks whose integral rank is the #i
+    integral_sorting = order[0]
+    #For each row (parameter): index i gives the #rank that peak position i has (inverse permutation of order).
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.broadcast_to(np.arange(np.shape(order)[1]), np.shape(order)), axis=1)
     
-    for el in range(len(peaks)):
-        peaks[el].integral_ = ranks[0,el]
-        peaks[el].width_ = ranks[1,el]
-        peaks[el].height_ = ranks[2,el]
-        peaks[el].fwhm_ = ranks[3,el]
-        peaks[el].ahh_ = ranks[4,el]
-        peaks[el].ahw_ = ranks[5,el]
-        peaks[el].num = peaks[el].integral_
+    for i,el in enumerate(peaks):
+        el.integral_, el.width_, el.height_, el.fwhm_, el.ahh_, el.ahw_ = ranks[:,i]
+        el.num = el.integral_
     
     #Build and return the new dictionary of peaks.
-    return {i: peaks[integral_sorting[i]] for i in range(len(peaks))}
+    return dict(enumerate([peaks[k] for k in integral_sorting]))
 
 def sampprocess(self):
     """It is a method.
@@ -348,20 +382,48 @@ def sampprocess(self):
         self.mi_tof, self.mii_tof = minima(processed)
         self.stripped = np.copy(processed)
 
-        #Iterate stripping over the minima
+        #Iterate stripping over the minima.
+        #Sweeping left to right, every point in between two minima is moved onto the line joining them.
+        #The minima are always those of the current stripped spectrum, but instead of looking for them all over
+        #again at each point, only the signs next to the moved point and the minima depending on them are updated.
+        #The minima before the point are kept in a list (the last one on top), and the first one after it
+        #is found by moving forward from the previous one.
+        x, y = self.stripped[0], self.stripped[1]
+        n = np.size(y)
         for it in range(cf.iterspeaks):
-            for i in range(np.shape(processed)[1]):
-                processed = np.copy(self.stripped)
-                _, tempmii = minima(processed)
-                iends = basic.InBetween(tempmii, i, False)
-                if iends[0] == 0: continue
-                if iends[0] == iends[1]: continue
-                if iends[0] is None or iends[1] is None: continue
-                x0, y0 = processed[0:2,iends[0]]
-                x1, y1 = processed[0:2,iends[1]]
+            dersgn = np.sign(np.diff(y))
+            ismin = basic.MaskExtrema(dersgn, -1)
+            before = []
+            after = 0
+            for i in range(n):
+                if ismin[i]:
+                    before.append(i)
+                    continue
+                if not before: continue
+                #There are no minima in between i and after.
+                if after <= i: after = i + 1
+                while after < n and not ismin[after]: after += 1
+                if after == n: break
+                i0, i1 = before[-1], after
+                x0, y0 = x[i0], y[i0]
+                x1, y1 = x[i1], y[i1]
                 A = (y1-y0)/(x1-x0)
                 B = (y0*x1-y1*x0)/(x1-x0)
-                self.stripped[1,i] = A*processed[0,i] + B
+                y[i] = A*x[i] + B
+                lo, hi = max(i-1, 0), min(i+1, n-1)
+                dersgn[lo:hi] = np.sign(np.diff(y[lo:hi+1]))
+                #Points whose minimum status may have changed: from the last nonzero sign before the moved point
+                #to the first nonzero sign after it.
+                kmin = lo
+                while kmin > 0 and dersgn[kmin-1] == 0: kmin -= 1
+                kmax = hi
+                while kmax < n-1 and dersgn[kmax] == 0: kmax += 1
+                start = max(kmin-1, 0)
+                ismin[kmin:kmax+1] = basic.MaskExtrema(dersgn[start:kmax+1], -1)[kmin-start:kmax+1-start]
+                #Minima before the next point, and the first one after it, within the updated points.
+                while before and before[-1] >= kmin: before.pop()
+                before.extend(k for k in range(kmin, i+1) if ismin[k])
+                after = next((k for k in range(i+1, kmax+1) if ismin[k]), max(after, kmax+1))
 
         self.stripped = basic.Smooth(self.stripped, 1)[:,1:]
 
@@ -369,22 +431,26 @@ def sampprocess(self):
         #i.e. [A, B, C, D] means A*x**3+B*x**2+C*x+D
         #Also fitted background.
         self.coeffs = np.polyfit(self.stripped[0],self.stripped[1],cf.fitting_coeff-1)
-        self.background_tof = np.vstack((self.spectrum_tof[0], np.poly1d(self.coeffs)(self.spectrum_tof[0])))
+        self.background_tof = np.vstack((self.spectrum_tof[0], np.polyval(self.coeffs, self.spectrum_tof[0])))
     except Exception as e:
         err.add(e,'sampprocess',self.fullname,-1)
 
 
 def RankNearest(Dict,xx):
-    closest_peak = np.empty((0,3))
-    for isotname in Dict:
-        isot = Dict[isotname]
-        dist = np.abs(isot.get_from_peaks('center_tof')-xx)
-        if np.size(dist) == 0: continue
-        closest_dist = np.min(dist)
-        nisot = np.argwhere(dist == closest_dist)[0,0]
-        closest_peak = np.append(closest_peak, np.array([isot, closest_dist, nisot]).reshape(1,-1), axis=0)
-    closest_isot = closest_peak[np.argsort(closest_peak[:,1])]
-    return closest_isot
+    """For each instance in Dict, finds its peak closest to xx, and ranks them by distance.
+    inputs:
+        - Dict: dictionary of Data instances
+        - xx: float
+            ToF value to look around
+    outputs:
+        - np.ndarray (dtype object) with a row per instance: instance, distance, peak number"""
+    closest_peak = []
+    for isot in Dict.values():
+        closest = isot.getclosest(xx)
+        if closest is None: continue
+        closest_peak.append((isot, closest[1], closest[0]))
+    closest_peak.sort(key=lambda row: row[1])
+    return np.array(closest_peak, dtype=object).reshape(-1,3)
 
 
 def MatchPeaks(self,distmax=cf.max_match,samp=None):
@@ -476,6 +542,7 @@ def ComparePeaks(self):
 
 def EditPeaks(self):
     try:
+        plt = plotter.pyplot()
         dictout = {}
         listnum = []
         through = False
@@ -521,6 +588,7 @@ def EditPeaks(self):
 
 def DeletePeaks(self):
     try:
+        plt = plotter.pyplot()
         listnum = []
         self.plot()
         while True:
@@ -541,15 +609,21 @@ def DeletePeaks(self):
 
 
 def pick(self,attr,magn):
-        if attr in self.__dict__ and attr+'_tof' in self.__dict__:
+        def has(a):
+            #Converted spectra and maxima are computed on first access, so they count as present.
+            if isinstance(getattr(type(self), a, None), cached_property): return True
+            #Peaks keep their attributes in slots.
+            if a in getattr(type(self), '__slots__', ()): return hasattr(self, a)
+            return a in self.__dict__
+        if has(attr) and has(attr+'_tof'):
             if magn in [1,True,'ToF','tof','time of flight']:
                 return getattr(self,attr+'_tof')
             else:
                 return getattr(self,attr)
         else:
-            if attr in self.__dict__:
+            if has(attr):
                 return getattr(self,attr)
-            elif attr+'_tof' in self.__dict__:
+            elif has(attr+'_tof'):
                 return getattr(self,attr+'_tof')
             else:
                 return None
\ No newline at end of file
@@ -7,21 +7,38 @@ Created on Wed Jun 26 15:08:15 2019
 """
 
 import os
-import sys
-from tqdm import tqdm
-from datetime import datetime
-import time
-import shutil
 
 import numpy as np
-import scipy.integrate as spint
-import matplotlib.pyplot as plt
 
 from . import spectra_Basics as basic
 from . import spectra_Finders as finder
 from .spectra_InitSettings import cf
 
 
+#Whether pyplot() has set matplotlib up already.
+pyplot_ready = False
+
+def pyplot():
+    """Imports matplotlib.pyplot and, the first time, turns interactive mode on, so that plots are detached from
+    the command line. Later calls leave it as it is, so plt.ioff() set by the user is kept.
+    Importing matplotlib is slow, so this is only done once something is actually plotted.
+    For batch runs (no display), set the environment variable NRCA_NOPLOT=1 or MPLBACKEND=Agg:
+    the non-interactive Agg backend is then used and interactive mode is left off.
+    output:
+        - matplotlib.pyplot module"""
+    global pyplot_ready
+    if not pyplot_ready:
+        import matplotlib
+        noplot = os.environ.get('NRCA_NOPLOT', '') not in ['', '0']
+        if noplot: matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        if not noplot and os.environ.get('MPLBACKEND', '').lower() != 'agg':
+            plt.ion()
+        pyplot_ready = True
+    import matplotlib.pyplot as plt
+    return plt
+
+
 def Plotter(data,tit='',showlim=0,showma=0,tof=False,axlabsin=False,peaklabs=False,vlines=None,ax=None,**kwargs):
     """The main plotting function. It does not create a figure, just its content.
     inputs:
@@ -54,6 +71,7 @@ def Plotter(data,tit='',showlim=0,showma=0,tof=False,axlabsin=False,peaklabs=Fal
     plt.figure()
     Plotter(...)
     plt.show()"""
+    plt = pyplot()
     islegend = False
     if type(data) not in [list,dict]:
         data = [data]
@@ -126,6 +144,7 @@ def Plot(self,same=True):
             True: what is there to be plotted will be showed together, in the same figure.
             False: an independent figure will be opened for each item.
     """
+    plt = pyplot()
     Dict = self.Substances()
     querylist = finder.Select(self.get_as_dict(),recursive=True)
     if querylist == []: return None
@@ -163,6 +182,7 @@ def plotone(self,num,side=None,title=None,prplot=cf.prplot,ax=None):
             number of mesh points each side of the peak to plot
         - ax: plt axes instance or None
             if given, plots in that axes. If None, plots in plt.gca()"""
+    plt = pyplot()
     
     color_dict = {
             1: 'black',
@@ -202,6 +222,7 @@ def plotpeaks(self,save=False,showlim=1,showma=1,peaklabs=True,**kwargs):
             True: saves the dataplot
             False: shows the dataplot
         - the rest of the inputs are the ones documented in Plotter"""
+    plt = pyplot()
     
     npeaks = self.npeaks
     nrows = int((npeaks-9)/4)+4 if npeaks > 8 else (2 if npeaks in [0,1,2,4] else 3)
@@ -246,6 +267,7 @@ def PlotBars(samp,isots=dict()):
     inputs:
         - samp: sample instance
         - isots: Data instances dictionary"""
+    plt = pyplot()
     fig, ax = plt.subplots(1,1)
     lowest = np.min(samp.background_tof[1])
     if len(isots) != 0:
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Start-up of the package without a terminal: the catalog must be built without asking anything.
+Each test imports a small copy of the package (a few data files) in a new interpreter, with stdin closed.
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class UnattendedLoadTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.pkg = os.path.join(self.tmp, 'nrca')
+        os.makedirs(self.pkg)
+        shutil.copytree(os.path.join(root, 'src'), os.path.join(self.pkg, 'src'),
+                        ignore=shutil.ignore_patterns('__pycache__'))
+        for f in ['__init__.py', 'paths.py', 'settings.py']:
+            shutil.copy(os.path.join(root, f), self.pkg)
+        for d in ['data', 'samples_n-tot', 'samples_n-g', 'load']:
+            os.makedirs(os.path.join(self.pkg, d))
+        for f in ['03-Li-7_n-tot.txt', '03-Li-7_n-g.txt']:
+            shutil.copy(os.path.join(root, 'data', f), os.path.join(self.pkg, 'data'))
+        shutil.copy(os.path.join(root, 'samples_n-g', '15673_bronze_agostino.txt'), os.path.join(self.pkg, 'samples_n-g'))
+        #Asks whether to import the peak properties, if found.
+        shutil.copy(os.path.join(root, 'load', 'peakprops.txt'), os.path.join(self.pkg, 'load'))
+        #Saved catalog, never read by these tests.
+        self.pickle = os.path.join(self.pkg, 'load', 'spcat.pickle')
+        open(self.pickle, 'wb').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def start(self, **extra):
+        env = dict(os.environ, NRCA_NOPLOT='1')
+        env.pop('NRCA_LOAD', None)
+        env.update(extra)
+        return subprocess.run([sys.executable, '-c', 'import nrca; print(sorted(nrca.spcat.isotopes))'],
+                              cwd=self.tmp, env=env, stdin=subprocess.DEVNULL,
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, timeout=600)
+
+    def test_stale_catalog(self):
+        #The catalog is older than the data files: a new one is built.
+        past = time.time() - 3600
+        os.utime(self.pickle, (past, past))
+        result = self.start()
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn('Creating a new catalog', result.stdout)
+        self.assertIn("['03-Li-7_n-g', '03-Li-7_n-tot']", result.stdout)
+
+    def test_no_load(self):
+        #The catalog is up to date, but loading it is refused.
+        future = time.time() + 3600
+        os.utime(self.pickle, (future, future))
+        result = self.start(NRCA_LOAD='0')
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn("['03-Li-7_n-g', '03-Li-7_n-tot']", result.stdout)
+
+
+if __name__ == '__main__':
+    unittest.main()